@@ -9,13 +9,22 @@ bl_info = {
 
 import bpy
 import bmesh
+import numpy as np
 
 # -----------------------------------------------------------------------------
 # GLOBAL STORAGE for "Revert" only (original materials).
-# Key = object name, Value = list of the original material references.
+# Key = object name, Value = original material names (by slot) and face material indices.
+# Names rather than references, so nothing dangles if a material is removed.
 # -----------------------------------------------------------------------------
 ORIGINAL_MATERIALS = {}
 
+# -----------------------------------------------------------------------------
+# GLOBAL CACHE for "Unpack" (materials already created from an atlas image).
+# Key = (image name, image pointer, column count), Value = list of material names.
+# The pointer changes when the image datablock is reloaded or replaced.
+# -----------------------------------------------------------------------------
+UNPACKED_MATERIALS = {}
+
 # -----------------------------------------------------------------------------
 # UTILITY FUNCTIONS
 # -----------------------------------------------------------------------------
@@ -26,12 +35,26 @@ def get_simple_emission_materials():
     """
     emission_materials = {}
     for mat in bpy.data.materials:
-        if mat.use_nodes:
-            for node in mat.node_tree.nodes:
+        if not mat.use_nodes:
+            continue
+        
+        # Look at the shader plugged into the active output first,
+        # so we don't have to walk every node of large shader graphs.
+        output = mat.node_tree.get_output_node('ALL')
+        if output:
+            surface = output.inputs["Surface"]
+            if surface.is_linked:
+                node = surface.links[0].from_node
                 if node.type == 'EMISSION':
-                    color = node.inputs["Color"].default_value[:3]
-                    emission_materials[mat.name] = color
-                    break
+                    emission_materials[mat.name] = node.inputs["Color"].default_value[:3]
+            continue
+        
+        # No active output: fall back to scanning all nodes
+        for node in mat.node_tree.nodes:
+            if node.type == 'EMISSION':
+                color = node.inputs["Color"].default_value[:3]
+                emission_materials[mat.name] = color
+                break
     return emission_materials
 
 
@@ -53,24 +76,23 @@ def create_texture_atlas(material_colors, atlas_width=1024, atlas_height=256):
     # Create a new blank image
     img = bpy.data.images.new("Emission_Atlas", width=atlas_width, height=atlas_height)
     
-    # Prepare a pixel buffer [R, G, B, A, ...]
-    pixels = [0.0] * (atlas_width * atlas_height * 4)
+    # Color table with one RGBA row per material, quantized to 8 bits per channel.
+    # The image is a byte image saved as 8-bit PNG, so this loses nothing.
+    colors = np.full((mat_count, 4), 255, dtype=np.uint8)
+    rgb = np.array([material_colors[mat_name] for mat_name in mat_list], dtype=np.float32)
+    colors[:, :3] = np.round(np.clip(rgb, 0.0, 1.0) * 255.0)
     
-    for i, mat_name in enumerate(mat_list):
-        color = material_colors[mat_name]
-        # The start (in pixels) of this material's column
-        x_start = i * column_width
-        
-        # Fill that column with the material color
-        for x in range(column_width):
-            for y in range(atlas_height):
-                px_index = ((y * atlas_width) + (x_start + x)) * 4
-                pixels[px_index + 0] = color[0]  # R
-                pixels[px_index + 1] = color[1]  # G
-                pixels[px_index + 2] = color[2]  # B
-                pixels[px_index + 3] = 1.0       # A
+    # Stretch each color across its column to get one image row.
+    # Any leftover pixels on the right edge stay fully transparent black.
+    row = np.zeros((atlas_width, 4), dtype=np.uint8)
+    row[:mat_count * column_width] = np.repeat(colors, column_width, axis=0)
     
-    img.pixels = pixels
+    # Every row of the atlas is identical. Image.pixels only takes floats, so the
+    # row is converted once and the full-size buffer only exists at upload.
+    buf = np.broadcast_to(row.astype(np.float32) / 255.0, (atlas_height, atlas_width, 4))
+    
+    # Upload the whole buffer in one call instead of going element by element
+    img.pixels.foreach_set(buf.ravel())
     img.filepath_raw = "//Emission_Atlas.png"
     img.file_format = 'PNG'
     img.save()
@@ -112,40 +134,65 @@ def create_atlas_material(texture):
     return mat
 
 
-def remap_uvs(obj, mat_index_map, atlas_width=1024, atlas_height=256):
+def remap_uvs(obj, mat_index_map, atlas_width=1024, atlas_height=256, material_indices=None):
     """
     Update UVs so that all faces using material i sample the i-th column in the atlas.
     - For single-color usage, we just pick the center of that column in U, and 0.5 in V.
+    - Works on the mesh arrays in bulk (foreach_get/foreach_set) instead of per loop.
+    - Pass material_indices if the caller already read them from the mesh.
+    - Does not call mesh.update(); the caller does that once it's done with the mesh.
     """
     mesh = obj.data
-    bm = bmesh.new()
-    bm.from_mesh(mesh)
-
-    uv_layer = bm.loops.layers.uv.verify()
 
     mat_count = len(mat_index_map)
     if mat_count == 0:
         return
     
-    column_width = atlas_width / mat_count  # in pixels
-    for face in bm.faces:
-        if face.material_index < len(obj.material_slots):
-            mat = obj.material_slots[face.material_index].material
-            if mat and mat.name in mat_index_map:
-                i = mat_index_map[mat.name]
-                
-                # Convert i to UV range. For single color, pick the column center:
-                u_min = (i * column_width) / atlas_width
-                u_max = ((i + 1) * column_width) / atlas_width
-                u_center = (u_min + u_max) * 0.5
-                v_center = 0.5  # halfway up the texture
-
-                # Assign all loops in this face the same UV
-                for loop in face.loops:
-                    loop[uv_layer].uv = (u_center, v_center)
+    # Use the active UV map, or create one if the mesh has none
+    uv_layer = mesh.uv_layers.active or mesh.uv_layers.new()
+    
+    poly_count = len(mesh.polygons)
+    loop_count = len(mesh.loops)
+    
+    if material_indices is None:
+        material_indices = np.empty(poly_count, dtype=np.int32)
+        mesh.polygons.foreach_get("material_index", material_indices)
+    loop_totals = np.empty(poly_count, dtype=np.int32)
+    mesh.polygons.foreach_get("loop_total", loop_totals)
+    
+    # Lookup table: material slot index -> atlas column (-1 if not in the atlas)
+    # (built straight from a generator, no intermediate list)
+    slot_columns = np.fromiter(
+        (mat_index_map.get(slot.material.name, -1) if slot.material else -1
+         for slot in obj.material_slots),
+        dtype=np.int32,
+        count=len(obj.material_slots),
+    )
+    
+    # Per-face atlas column; faces pointing past the last slot are left alone
+    face_columns = np.full(poly_count, -1, dtype=np.int32)
+    in_range = material_indices < len(slot_columns)
+    face_columns[in_range] = slot_columns[material_indices[in_range]]
     
-    bm.to_mesh(mesh)
-    bm.free()
+    # A face's loops are stored contiguously, so expand per-face values per loop
+    loop_columns = np.repeat(face_columns, loop_totals)
+    valid = loop_columns >= 0
+    if not valid.any():
+        return
+    
+    # Column center in U (i.e. (i + 0.5) / mat_count), halfway up the texture in V
+    uvs = np.empty((loop_count, 2), dtype=np.float32)
+    if valid.all():
+        # Every loop gets remapped, no need to read the existing UVs back
+        uvs[:, 0] = (loop_columns + 0.5) / mat_count
+        uvs[:, 1] = 0.5
+    else:
+        # Keep the existing UVs of faces whose material isn't in the atlas
+        uv_layer.data.foreach_get("uv", uvs.ravel())
+        uvs[valid, 0] = (loop_columns[valid] + 0.5) / mat_count
+        uvs[valid, 1] = 0.5
+    
+    uv_layer.data.foreach_set("uv", uvs.ravel())
 
 
 def create_single_color_emission_material(name, color):
@@ -206,23 +253,25 @@ class ConvertToEmissionAtlas(bpy.types.Operator):
             if obj.type != "MESH":
                 continue
 
+            mesh = obj.data
+
             # Store original materials & face material indices
-            bm = bmesh.new()
-            bm.from_mesh(obj.data)
+            material_indices = np.empty(len(mesh.polygons), dtype=np.int32)
+            mesh.polygons.foreach_get("material_index", material_indices)
             
             ORIGINAL_MATERIALS[obj.name] = {
-                "materials": [ms.material for ms in obj.material_slots],
-                "material_indices": [face.material_index for face in bm.faces],
+                "materials": [ms.material.name if ms.material else None for ms in obj.material_slots],
+                "material_indices": material_indices.tolist(),
             }
             
-            bm.free()
-            
-            # Update UVs
-            remap_uvs(obj, mat_index_map, atlas_width=atlas.size[0], atlas_height=atlas.size[1])
+            # Update UVs, reusing the material indices we just read
+            remap_uvs(obj, mat_index_map, atlas_width=atlas.size[0], atlas_height=atlas.size[1],
+                      material_indices=material_indices)
             
             # Replace all materials with the new atlas
-            obj.data.materials.clear()
-            obj.data.materials.append(atlas_mat)
+            mesh.materials.clear()
+            mesh.materials.append(atlas_mat)
+            mesh.update()
         
         self.report({'INFO'}, "Emission Texture Atlas Generated Successfully!")
         return {'FINISHED'}
@@ -242,6 +291,8 @@ class RevertEmissionAtlas(bpy.types.Operator):
             self.report({'WARNING'}, "No stored original materials to revert.")
             return {'CANCELLED'}
         
+        materials = bpy.data.materials
+        
         for obj in context.selected_objects:
             if obj.name not in ORIGINAL_MATERIALS:
                 # This object wasn't stored; skip
@@ -255,9 +306,10 @@ class RevertEmissionAtlas(bpy.types.Operator):
 
                 # 2) Recreate the original material slots
                 restored_materials = []
-                for stored_mat in mat_data["materials"]:
-                    if stored_mat and stored_mat.name in bpy.data.materials:
-                        restored_materials.append(bpy.data.materials[stored_mat.name])
+                for mat_name in mat_data["materials"]:
+                    stored_mat = materials.get(mat_name) if mat_name else None
+                    if stored_mat:
+                        restored_materials.append(stored_mat)
                     else:
                         # Option A: Skip None or missing materials
                         # (But this changes the material slot count.)
@@ -303,10 +355,6 @@ class UnpackEmissionAtlas(bpy.types.Operator):
         # 1. Identify the atlas image from the first material slot that references it.
         #    We'll assume all selected objects share the same atlas for simplicity.
         
-        # A dictionary to store "which atlas image" -> "list of new materials"
-        # so we don't keep re-creating them if multiple objects share the same atlas.
-        created_material_sets = {}
-        
         for obj in context.selected_objects:
             if obj.type != "MESH":
                 continue
@@ -335,22 +383,25 @@ class UnpackEmissionAtlas(bpy.types.Operator):
             if columns < 1:
                 columns = 1
             
-            # 2. If we haven't already created new materials for this atlas, do so now
-            if atlas_image.name not in created_material_sets:
-                # Sample the pixel data from the image
-                pixels = list(atlas_image.pixels)
+            # 2. If we haven't already created new materials for this atlas, do so now.
+            #    Reuse them across objects and across runs unless one has been deleted.
+            cache_key = (atlas_image.name, atlas_image.as_pointer(), columns)
+            new_materials = [bpy.data.materials.get(name) for name in UNPACKED_MATERIALS.get(cache_key, ())]
+            if not new_materials or any(nm is None for nm in new_materials):
+                # Read the pixel data straight into a float buffer
+                pixels = np.empty(atlas_width * atlas_height * 4, dtype=np.float32)
+                atlas_image.pixels.foreach_get(pixels)
+                pixels = pixels.reshape(atlas_height, atlas_width, 4)
                 column_width = atlas_width // columns
                 
-                new_mats = []
+                # Sample every column center, halfway up the image, in one go
+                center_y = atlas_height // 2
+                centers_x = ((np.arange(columns) + 0.5) * column_width).astype(np.int32)
+                samples = pixels[center_y, centers_x, :3]
+                
+                new_materials = []
                 for i in range(columns):
-                    center_x = int((i + 0.5) * column_width)
-                    # Just sample halfway up the image
-                    center_y = atlas_height // 2
-                    
-                    px_index = ((center_y * atlas_width) + center_x) * 4
-                    r = pixels[px_index + 0]
-                    g = pixels[px_index + 1]
-                    b = pixels[px_index + 2]
+                    r, g, b = samples[i].tolist()
                     
                     # Create a new single-color emission material
                     mat_name = f"UnpackedAtlasColor_{i}"
@@ -360,49 +411,35 @@ class UnpackEmissionAtlas(bpy.types.Operator):
                     else:
                         new_mat = create_single_color_emission_material(mat_name, (r, g, b))
                     
-                    new_mats.append(new_mat)
+                    new_materials.append(new_mat)
                 
-                created_material_sets[atlas_image.name] = new_mats
+                UNPACKED_MATERIALS[cache_key] = [nm.name for nm in new_materials]
             
             # 3. Assign the newly created single-color materials to this object
-            new_materials = created_material_sets[atlas_image.name]
             # Clear existing material slots
             obj.data.materials.clear()
             for nm in new_materials:
                 obj.data.materials.append(nm)
             
-            # 4. BMesh pass: for each face, figure out which column it's sampling
-            bm = bmesh.new()
-            bm.from_mesh(obj.data)
-            uv_layer = bm.loops.layers.uv.verify()
+            # 4. For each face, figure out which column it's sampling
+            mesh = obj.data
+            uv_layer = mesh.uv_layers.active or mesh.uv_layers.new()
             
-            column_width_float = float(atlas_width) / columns
+            poly_count = len(mesh.polygons)
+            loop_starts = np.empty(poly_count, dtype=np.int32)
+            mesh.polygons.foreach_get("loop_start", loop_starts)
             
-            for face in bm.faces:
-                if len(face.loops) == 0:
-                    continue
-                
-                # We'll just look at the first loop's UV
-                uv = face.loops[0][uv_layer].uv
-                # Convert to pixel coordinates
-                x_pix = uv.x * atlas_width
-                # clamp
-                if x_pix < 0:
-                    x_pix = 0
-                elif x_pix >= atlas_width:
-                    x_pix = atlas_width - 1
-                
-                # figure out which column
-                col_index = int(x_pix // column_width_float)
-                if col_index < 0:
-                    col_index = 0
-                elif col_index >= columns:
-                    col_index = columns - 1
-                
-                face.material_index = col_index
+            uvs = np.empty(len(mesh.loops) * 2, dtype=np.float32)
+            uv_layer.data.foreach_get("uv", uvs)
+            uvs = uvs.reshape(-1, 2)
+            
+            # We'll just look at the first loop's UV. Dividing the pixel x by the
+            # column width is the same as scaling U by the column count.
+            first_u = uvs[loop_starts, 0]
+            col_indices = np.clip(np.floor(first_u * columns), 0, columns - 1).astype(np.int32)
             
-            bm.to_mesh(obj.data)
-            bm.free()
+            mesh.polygons.foreach_set("material_index", col_indices)
+            mesh.update()
         
         self.report({'INFO'}, "Unpacked atlas into new single-color materials.")
         return {'FINISHED'}
@@ -8,43 +8,43 @@
 # - If --as-zip is not specified, it creates a folder instead of a zip archive.
 
 import os
-import re
 import shutil
 import sys
 import zipfile
 import ast
+from functools import lru_cache
 
 SCRIPT_FILE = "emission_atlas.py"
 OUTPUT_FOLDER = "emission_atlas"
+# Releases smaller than this are stored uncompressed; deflating them isn't worth it
+STORE_THRESHOLD = 64 * 1024
 
 # -----------------------------
 # Extract version info from bl_info
 # -----------------------------
-def get_blender_version(file_path):
-    """Extracts the 'blender' version from bl_info in the addon script."""
+@lru_cache(maxsize=1)
+def get_bl_info(file_path):
+    """Reads and parses the bl_info dict from the addon script (only once per path)."""
     with open(file_path, 'r', encoding='utf-8') as file:
         content = file.read()
-        match = re.search(r"bl_info\s*=\s*{([^}]*)}", content, re.DOTALL)
-        if match:
+    try:
+        tree = ast.parse(content)
+    except SyntaxError:
+        return None
+    # Find the top-level `bl_info = {...}` assignment and evaluate just its value
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(
+            isinstance(target, ast.Name) and target.id == "bl_info" for target in node.targets
+        ):
             try:
-                bl_info_dict = ast.literal_eval(f"{{{match.group(1)}}}")
-                return ".".join(map(str, bl_info_dict.get("blender", (0, 0, 0))))
-            except (SyntaxError, ValueError):
+                return ast.literal_eval(node.value)
+            except ValueError:
                 return None
     return None
 
-def get_version(file_path):
-    """Extracts the 'version' from bl_info in the addon script."""
-    with open(file_path, 'r', encoding='utf-8') as file:
-        content = file.read()
-        match = re.search(r"bl_info\s*=\s*{([^}]*)}", content, re.DOTALL)
-        if match:
-            try:
-                bl_info_dict = ast.literal_eval(f"{{{match.group(1)}}}")
-                return ".".join(map(str, bl_info_dict.get("version", (0, 0, 0))))
-            except (SyntaxError, ValueError):
-                return None
-    return None
+def format_version(version_tuple):
+    """Joins a version tuple into a dotted string ((1, 2, 3) → '1.2.3')."""
+    return ".".join(map(str, version_tuple))
 
 def increment_version(version):
     """Increments the last part of a semantic version string (x.y.z → x.y.z+1)."""
@@ -73,43 +73,48 @@ def main():
 
     # Extract bl_info if not provided via command-line arguments
     if target_blender is None:
-        target_blender = get_blender_version(SCRIPT_FILE)
-        if target_blender is None:
+        bl_info = get_bl_info(SCRIPT_FILE)
+        if bl_info is None:
             print("Error: Could not determine target Blender version from emission_atlas.py")
             return
+        target_blender = format_version(bl_info.get("blender", (0, 0, 0)))
 
     if version is None:
-        version = get_version(SCRIPT_FILE)
+        bl_info = get_bl_info(SCRIPT_FILE)
+        if bl_info is not None:
+            version = format_version(bl_info.get("version", (0, 0, 0)))
         version = increment_version(version)
 
     # Output names
     zip_file_name = f"emission_atlas_{version}_blender_{target_blender}.zip"
 
-    # Remove existing build folder if it exists
-    if os.path.exists(OUTPUT_FOLDER):
-        shutil.rmtree(OUTPUT_FOLDER)
-    
-    os.mkdir(OUTPUT_FOLDER)
+    # Files that go into the release
+    release_files = [SCRIPT_FILE] + [f for f in ("LICENSE", "README.md") if os.path.exists(f)]
 
-    # Copy necessary files
-    shutil.copy(SCRIPT_FILE, OUTPUT_FOLDER)
-    if os.path.exists("LICENSE"):
-        shutil.copy("LICENSE", OUTPUT_FOLDER)
-    if os.path.exists("README.md"):
-        shutil.copy("README.md", OUTPUT_FOLDER)
-
-    # If `--as-zip` was provided, package everything into a zip file
+    # If `--as-zip` was provided, write the files straight into a zip file
     if as_zip:
-        with zipfile.ZipFile(zip_file_name, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for root, _, files in os.walk(OUTPUT_FOLDER):
-                for file in files:
-                    zipf.write(os.path.join(root, file), os.path.relpath(os.path.join(root, file), OUTPUT_FOLDER))
+        total_size = sum(os.path.getsize(file) for file in release_files)
+        if total_size < STORE_THRESHOLD:
+            compression, compresslevel = zipfile.ZIP_STORED, None
+        else:
+            compression, compresslevel = zipfile.ZIP_DEFLATED, 6
 
-        # Clean up the folder after zipping
-        shutil.rmtree(OUTPUT_FOLDER)
+        with zipfile.ZipFile(zip_file_name, 'w', compression, compresslevel=compresslevel) as zipf:
+            for file in release_files:
+                zipf.write(file, arcname=os.path.basename(file))
 
         print(f"✅ Build complete: {zip_file_name}")
     else:
+        # Remove existing build folder if it exists
+        if os.path.exists(OUTPUT_FOLDER):
+            shutil.rmtree(OUTPUT_FOLDER)
+
+        os.mkdir(OUTPUT_FOLDER)
+
+        # Copy necessary files
+        for file in release_files:
+            shutil.copy(file, OUTPUT_FOLDER)
+
         print(f"✅ Build complete: Folder '{OUTPUT_FOLDER}' created")
 
 # -----------------------------